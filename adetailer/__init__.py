@@ -2,7 +2,12 @@ from .__version__ import __version__
 from .args import ALL_ARGS, ADetailerArgs
 from .common import PredictOutput, get_models
 from .mediapipe import mediapipe_predict
-from .ultralytics import ultralytics_predict
+from .ultralytics import (
+    export_path,
+    ultralytics_export,
+    ultralytics_predict,
+    ultralytics_predict_batch,
+)
 
 AFTER_DETAILER = "ADetailer"
 
@@ -12,7 +17,10 @@ __all__ = [
     "AFTER_DETAILER",
     "ALL_ARGS",
     "PredictOutput",
+    "export_path",
     "get_models",
     "mediapipe_predict",
+    "ultralytics_export",
     "ultralytics_predict",
+    "ultralytics_predict_batch",
 ]
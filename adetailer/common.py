@@ -2,8 +2,9 @@ from __future__ import annotations
 
 from collections import OrderedDict
 from dataclasses import dataclass, field
+from functools import cached_property
 from pathlib import Path
-from typing import Optional, Union
+from typing import Callable, Optional, Union
 
 from huggingface_hub import hf_hub_download
 from PIL import Image, ImageDraw
@@ -17,7 +18,13 @@ _download_failed = False
 class PredictOutput:
     bboxes: list[list[int | float]] = field(default_factory=list)
     masks: list[Image.Image] = field(default_factory=list)
-    preview: Optional[Image.Image] = None
+    image_size: tuple[int, int] = (0, 0)
+    preview_fn: Optional[Callable[[], Image.Image]] = field(default=None, repr=False)
+
+    @cached_property
+    def preview(self) -> Optional[Image.Image]:
+        "drawn on first access, as it is only needed for live preview and saving."
+        return self.preview_fn() if self.preview_fn is not None else None
 
 
 def hf_download(file: str):
@@ -1,7 +1,7 @@
 from __future__ import annotations
 
 from enum import IntEnum
-from functools import partial, reduce
+from functools import partial
 from math import dist
 
 import cv2
@@ -35,6 +35,16 @@ def _erode(arr: np.ndarray, value: int) -> np.ndarray:
     return cv2.erode(arr, kernel, iterations=1)
 
 
+def _dilate_erode_stack(arr: np.ndarray, value: int) -> np.ndarray:
+    """
+    Dilate or erode a stack of masks of shape (N, H, W) in one cv2 call,
+    by treating the N masks as the channels of a single image.
+    """
+    hwc = np.ascontiguousarray(arr.transpose(1, 2, 0))
+    hwc = _dilate(hwc, value) if value > 0 else _erode(hwc, -value)
+    return hwc.reshape(*hwc.shape[:2], -1).transpose(2, 0, 1)
+
+
 def dilate_erode(img: Image.Image, value: int) -> Image.Image:
     """
     The dilate_erode function takes an image and a value.
@@ -98,10 +108,12 @@ def mask_preprocess(
     x_offset: int = 0,
     y_offset: int = 0,
     merge_invert: int | MergeInvert | str = MergeInvert.NONE,
-) -> list[Image.Image]:
+) -> np.ndarray:
     """
     The mask_preprocess function takes a list of masks and preprocesses them.
     It dilates and erodes the masks, and offsets them by x_offset and y_offset.
+    The masks are kept in a single array; convert each one with
+    `Image.fromarray` where a PIL image is needed.
 
     Parameters
     ----------
@@ -116,20 +128,23 @@ def mask_preprocess(
 
     Returns
     -------
-        list[Image.Image]
-            A list of processed masks
+        np.ndarray
+            The processed masks, uint8 array of shape (N, H, W)
     """
     if not masks:
-        return []
+        return np.empty((0, 0, 0), dtype=np.uint8)
+
+    arr = np.stack([np.array(m) for m in masks])
 
     if x_offset != 0 or y_offset != 0:
-        masks = [offset(m, x_offset, y_offset) for m in masks]
+        # same wrap-around as `offset`
+        arr = np.roll(arr, (-y_offset, x_offset), axis=(1, 2))
 
     if kernel != 0:
-        masks = [dilate_erode(m, kernel) for m in masks]
-        masks = [m for m in masks if not is_all_black(m)]
+        arr = _dilate_erode_stack(arr, kernel)
+        arr = arr[arr.any(axis=(1, 2))]
 
-    return mask_merge_invert(masks, mode=merge_invert)
+    return mask_merge_invert(arr, mode=merge_invert)
 
 
 # Bbox sorting
@@ -181,7 +196,7 @@ def sort_bboxes(
     if order == SortBy.LEFT_TO_RIGHT:
         key = _key_left_to_right
     elif order == SortBy.CENTER_TO_EDGE:
-        width, height = pred.preview.size
+        width, height = pred.image_size
         center = (width / 2, height / 2)
         key = partial(_key_center_to_edge, center=center)
     elif order == SortBy.AREA:
@@ -206,7 +221,7 @@ def filter_by_ratio(pred: PredictOutput, low: float, high: float) -> PredictOutp
     if not pred.bboxes:
         return pred
 
-    w, h = pred.preview.size
+    w, h = pred.image_size
     orig_area = w * h
     items = len(pred.bboxes)
     idx = [i for i in range(items) if is_in_ratio(pred.bboxes[i], low, high, orig_area)]
@@ -227,23 +242,20 @@ def filter_k_largest(pred: PredictOutput, k: int = 0) -> PredictOutput:
 
 
 # Merge / Invert
-def mask_merge(masks: list[Image.Image]) -> list[Image.Image]:
-    arrs = [np.array(m) for m in masks]
-    arr = reduce(cv2.bitwise_or, arrs)
-    return [Image.fromarray(arr)]
+# masks: uint8 array of shape (N, H, W)
+def mask_merge(masks: np.ndarray) -> np.ndarray:
+    return np.bitwise_or.reduce(masks, axis=0, keepdims=True)
 
 
-def mask_invert(masks: list[Image.Image]) -> list[Image.Image]:
-    return [ImageChops.invert(m) for m in masks]
+def mask_invert(masks: np.ndarray) -> np.ndarray:
+    return np.bitwise_not(masks)
 
 
-def mask_merge_invert(
-    masks: list[Image.Image], mode: int | MergeInvert | str
-) -> list[Image.Image]:
+def mask_merge_invert(masks: np.ndarray, mode: int | MergeInvert | str) -> np.ndarray:
     if isinstance(mode, str):
         mode = MASK_MERGE_INVERT.index(mode)
 
-    if mode == MergeInvert.NONE or not masks:
+    if mode == MergeInvert.NONE or len(masks) == 0:
         return masks
 
     if mode == MergeInvert.MERGE:
@@ -254,3 +266,29 @@ def mask_merge_invert(
         return mask_invert(merged)
 
     raise RuntimeError
+
+
+def merge_disjoint_masks(masks: np.ndarray) -> np.ndarray:
+    """
+    Greedily merge masks that do not overlap each other, so that each group
+    can be inpainted in a single pass.
+
+    Parameters
+    ----------
+        masks: np.ndarray
+            uint8 array of shape (N, H, W)
+
+    Returns
+    -------
+        np.ndarray
+            The merged masks, in order of first appearance
+    """
+    groups: list[np.ndarray] = []
+    for arr in masks:
+        for i, group in enumerate(groups):
+            if not np.any(group & arr):
+                groups[i] = group | arr
+                break
+        else:
+            groups.append(arr)
+    return np.stack(groups) if groups else masks
@@ -46,12 +46,14 @@ def mediapipe_face_detection(
     if pred.detections is None:
         return PredictOutput()
 
-    preview_array = img_array.copy()
+    def make_preview() -> Image.Image:
+        preview_array = img_array.copy()
+        for detection in pred.detections:
+            draw_util.draw_detection(preview_array, detection)
+        return Image.fromarray(preview_array)
 
     bboxes = []
     for detection in pred.detections:
-        draw_util.draw_detection(preview_array, detection)
-
         bbox = detection.location_data.relative_bounding_box
         x1 = bbox.xmin * img_width
         y1 = bbox.ymin * img_height
@@ -63,9 +65,10 @@ def mediapipe_face_detection(
         bboxes.append([x1, y1, x2, y2])
 
     masks = create_mask_from_bbox(bboxes, image.size)
-    preview = Image.fromarray(preview_array)
 
-    return PredictOutput(bboxes=bboxes, masks=masks, preview=preview)
+    return PredictOutput(
+        bboxes=bboxes, masks=masks, image_size=image.size, preview_fn=make_preview
+    )
 
 
 def mediapipe_face_mesh(image: Image.Image, confidence: float = 0.3) -> PredictOutput:
@@ -86,18 +89,21 @@ def mediapipe_face_mesh(image: Image.Image, confidence: float = 0.3) -> PredictO
         if pred.multi_face_landmarks is None:
             return PredictOutput()
 
-        preview = arr.copy()
+        def make_preview() -> Image.Image:
+            preview = arr.copy()
+            for landmarks in pred.multi_face_landmarks:
+                draw_util.draw_landmarks(
+                    image=preview,
+                    landmark_list=landmarks,
+                    connections=mp_face_mesh.FACEMESH_TESSELATION,
+                    landmark_drawing_spec=None,
+                    connection_drawing_spec=drawing_styles.get_default_face_mesh_tesselation_style(),
+                )
+            return Image.fromarray(preview)
+
         masks = []
 
         for landmarks in pred.multi_face_landmarks:
-            draw_util.draw_landmarks(
-                image=preview,
-                landmark_list=landmarks,
-                connections=mp_face_mesh.FACEMESH_TESSELATION,
-                landmark_drawing_spec=None,
-                connection_drawing_spec=drawing_styles.get_default_face_mesh_tesselation_style(),
-            )
-
             points = np.intp([(land.x * w, land.y * h) for land in landmarks.landmark])
             outline = cv2.convexHull(points).reshape(-1).tolist()
 
@@ -107,8 +113,9 @@ def mediapipe_face_mesh(image: Image.Image, confidence: float = 0.3) -> PredictO
             masks.append(mask)
 
         bboxes = create_bbox_from_mask(masks, image.size)
-        preview = Image.fromarray(preview)
-        return PredictOutput(bboxes=bboxes, masks=masks, preview=preview)
+        return PredictOutput(
+            bboxes=bboxes, masks=masks, image_size=image.size, preview_fn=make_preview
+        )
 
 
 def mediapipe_face_mesh_eyes_only(
@@ -132,7 +139,6 @@ def mediapipe_face_mesh_eyes_only(
         if pred.multi_face_landmarks is None:
             return PredictOutput()
 
-        preview = image.copy()
         masks = []
 
         for landmarks in pred.multi_face_landmarks:
@@ -149,8 +155,12 @@ def mediapipe_face_mesh_eyes_only(
             masks.append(mask)
 
         bboxes = create_bbox_from_mask(masks, image.size)
-        preview = draw_preview(preview, bboxes, masks)
-        return PredictOutput(bboxes=bboxes, masks=masks, preview=preview)
+        return PredictOutput(
+            bboxes=bboxes,
+            masks=masks,
+            image_size=image.size,
+            preview_fn=lambda: draw_preview(image.copy(), bboxes, masks),
+        )
 
 
 def draw_preview(
@@ -1,7 +1,7 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
-from functools import partial
+from functools import lru_cache, partial
 from types import SimpleNamespace
 from typing import Any
 
@@ -48,25 +48,32 @@ def gr_interactive(value: bool = True):
     return gr.update(interactive=value)
 
 
+@lru_cache(maxsize=None)
 def ordinal(n: int) -> str:
     d = {1: "st", 2: "nd", 3: "rd"}
     return str(n) + ("th" if 11 <= n % 100 <= 13 else d.get(n % 10, "th"))
 
 
+@lru_cache(maxsize=None)
 def suffix(n: int, c: str = " ") -> str:
     return "" if n == 0 else c + ordinal(n + 1)
 
 
-def on_widget_change(state: dict, value: Any, *, attr: str):
-    state[attr] = value
-    return state
-
-
-def on_generate_click(state: dict, *values: Any):
-    for attr, value in zip(ALL_ARGS.attrs, values):
-        state[attr] = value
-    state["is_api"] = ()
-    return state
+def on_generate_click(*values: Any):
+    """
+    `values` is the state of every tab, followed by the widget values of
+    every tab in the same order.
+    """
+    size = len(ALL_ARGS.attrs)
+    num_models = len(values) // (size + 1)
+    states = values[:num_models]
+    for n, state in enumerate(states):
+        start = num_models + n * size
+        for attr, value in zip(ALL_ARGS.attrs, values[start : start + size]):
+            state[attr] = value
+        state["is_api"] = ()
+    # gradio wraps the return value itself when there is a single output
+    return states if num_models > 1 else states[0]
 
 
 def on_cn_model_update(cn_model_name: str):
@@ -89,6 +96,7 @@ def adui(
     webui_info: WebuiInfo,
 ):
     states = []
+    widgets = []
     infotext_fields = []
     eid = partial(elem_id, n=0, is_img2img=is_img2img)
 
@@ -122,15 +130,24 @@ def adui(
         with gr.Group(), gr.Tabs():
             for n in range(num_models):
                 with gr.Tab(ordinal(n + 1)):
-                    state, infofields = one_ui_group(
+                    state, w, infofields = one_ui_group(
                         n=n,
                         is_img2img=is_img2img,
                         webui_info=webui_info,
                     )
 
                 states.append(state)
+                widgets.extend(w.tolist())
                 infotext_fields.extend(infofields)
 
+    target_button = webui_info.i2i_button if is_img2img else webui_info.t2i_button
+    target_button.click(
+        fn=on_generate_click,
+        inputs=[*states, *widgets],
+        outputs=states,
+        queue=False,
+    )
+
     # components: [bool, dict, dict, ...]
     components = [ad_enable, ad_skip_img2img, *states]
     return components, infotext_fields
@@ -248,15 +265,9 @@ def one_ui_group(n: int, is_img2img: bool, webui_info: WebuiInfo):
                     elem_id=eid("ad_makeup_edge_smoothing"),
                 )
 
-    all_inputs = [state, *w.tolist()]
-    target_button = webui_info.i2i_button if is_img2img else webui_info.t2i_button
-    target_button.click(
-        fn=on_generate_click, inputs=all_inputs, outputs=state, queue=False
-    )
-
     infotext_fields = [(getattr(w, attr), name + suffix(n)) for attr, name in ALL_ARGS]
 
-    return state, infotext_fields
+    return state, w, infotext_fields
 
 
 def detection(w: Widgets, n: int, is_img2img: bool):
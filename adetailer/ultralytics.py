@@ -1,40 +1,143 @@
 from __future__ import annotations
 
+import shutil
+from functools import partial
 from pathlib import Path
+from typing import TYPE_CHECKING
 
 import cv2
+import numpy as np
+import torch
 from PIL import Image
 from torchvision.transforms.functional import to_pil_image
 
 from adetailer import PredictOutput
 from adetailer.common import create_mask_from_bbox
 
+if TYPE_CHECKING:
+    from ultralytics import YOLO
+
+
+def load_yolo(model_path: str | Path | YOLO) -> YOLO:
+    from ultralytics import YOLO
+
+    if isinstance(model_path, (str, Path)):
+        return YOLO(model_path)
+    return model_path
+
 
 def ultralytics_predict(
-    model_path: str | Path,
+    model_path: str | Path | YOLO,
     image: Image.Image,
     confidence: float = 0.3,
     device: str = "",
 ) -> PredictOutput:
-    from ultralytics import YOLO
-
-    model = YOLO(model_path)
+    model = load_yolo(model_path)
     pred = model(image, conf=confidence, device=device)
+    return result_to_output(pred[0], image.size)
+
+
+def ultralytics_predict_batch(
+    model_path: str | Path | YOLO,
+    images: list[Image.Image] | list[np.ndarray],
+    confidence: float = 0.3,
+    device: str = "",
+    batch_size: int = 4,
+) -> list[PredictOutput]:
+    """
+    Same as `ultralytics_predict`, but runs the detector on `batch_size` images
+    at a time and returns one `PredictOutput` per image, in order.
+
+    `images` can also be HWC uint8 arrays in BGR order, as ultralytics expects.
+    """
+    model = load_yolo(model_path)
+    outputs = []
+    for start in range(0, len(images), batch_size):
+        chunk = images[start : start + batch_size]
+        preds = model(chunk, conf=confidence, device=device)
+        outputs.extend(
+            result_to_output(pred, image_size(image))
+            for pred, image in zip(preds, chunk)
+        )
+    return outputs
+
+
+def export_path(
+    model_path: str | Path, output_dir: str | Path, device: str = "", batch: int = 1
+) -> Path:
+    """
+    Where `ultralytics_export` puts the exported model: a TensorRT engine on
+    CUDA, ONNX otherwise. ultralytics can load it in place of the `.pt` file.
+    An engine only accepts batches up to the size it was built with, so that
+    size is part of its file name.
+    """
+    stem = Path(model_path).stem
+    if device != "cpu" and torch.cuda.is_available():
+        return Path(output_dir, f"{stem}-b{batch}.engine")
+    return Path(output_dir, f"{stem}.onnx")
 
-    bboxes = pred[0].boxes.xyxy.cpu().numpy()
+
+def ultralytics_export(
+    model_path: str | Path | YOLO, target: str | Path, batch: int = 1
+) -> str:
+    """
+    ultralytics writes the export next to the source `.pt`, which may be in
+    the Hugging Face cache. It is moved to `target`, and the intermediate
+    `.onnx` left behind by a TensorRT export is removed.
+    """
+    target = Path(target)
+    use_trt = target.suffix == ".engine"
+    exported = Path(
+        load_yolo(model_path).export(
+            format=target.suffix[1:], half=use_trt, imgsz=640, dynamic=True, batch=batch
+        )
+    )
+    shutil.move(exported, target)
+    if use_trt:
+        exported.with_suffix(".onnx").unlink(missing_ok=True)
+    return str(target)
+
+
+def image_size(image: Image.Image | np.ndarray) -> tuple[int, int]:
+    "(width, height) of a PIL image or an HWC array"
+    if isinstance(image, Image.Image):
+        return image.size
+    height, width = image.shape[:2]
+    return width, height
+
+
+def result_to_output(pred, shape: tuple[int, int]) -> PredictOutput:
+    """
+    Parameters
+    ----------
+    pred: ultralytics.engine.results.Results
+        A single result of a YOLO prediction.
+
+    shape: tuple[int, int]
+        (width, height) of the original image
+    """
+    bboxes = pred.boxes.xyxy.cpu().numpy()
     if bboxes.size == 0:
         return PredictOutput()
     bboxes = bboxes.tolist()
 
-    if pred[0].masks is None:
-        masks = create_mask_from_bbox(bboxes, image.size)
+    if pred.masks is None:
+        masks = create_mask_from_bbox(bboxes, shape)
     else:
-        masks = mask_to_pil(pred[0].masks.data, image.size)
-    preview = pred[0].plot()
-    preview = cv2.cvtColor(preview, cv2.COLOR_BGR2RGB)
-    preview = Image.fromarray(preview)
+        masks = mask_to_pil(pred.masks.data, shape)
+
+    return PredictOutput(
+        bboxes=bboxes,
+        masks=masks,
+        image_size=shape,
+        preview_fn=partial(plot_preview, pred),
+    )
 
-    return PredictOutput(bboxes=bboxes, masks=masks, preview=preview)
+
+def plot_preview(pred) -> Image.Image:
+    preview = pred.plot()
+    preview = cv2.cvtColor(preview, cv2.COLOR_BGR2RGB)
+    return Image.fromarray(preview)
 
 
 def mask_to_pil(masks, shape: tuple[int, int]) -> list[Image.Image]:
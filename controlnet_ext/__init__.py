@@ -1,7 +1,13 @@
-from .controlnet_ext import ControlNetExt, controlnet_exists, get_cn_models
+from .controlnet_ext import (
+    ControlNetExt,
+    clear_cn_models_cache,
+    controlnet_exists,
+    get_cn_models,
+)
 
 __all__ = [
     "ControlNetExt",
+    "clear_cn_models_cache",
     "controlnet_exists",
     "get_cn_models",
 ]
@@ -156,3 +156,7 @@ def get_cn_models() -> list[str]:
     if controlnet_exists:
         return _get_cn_models()
     return []
+
+
+def clear_cn_models_cache() -> None:
+    _get_cn_models.cache_clear()
@@ -6,8 +6,8 @@ import re
 import sys
 import traceback
 from contextlib import contextmanager, suppress
-from copy import copy, deepcopy
-from functools import partial
+from copy import copy
+from functools import lru_cache, partial
 from pathlib import Path
 from textwrap import dedent
 from typing import Any, NamedTuple
@@ -22,9 +22,12 @@ import modules
 from adetailer import (
     AFTER_DETAILER,
     __version__,
+    export_path,
     get_models,
     mediapipe_predict,
+    ultralytics_export,
     ultralytics_predict,
+    ultralytics_predict_batch,
 )
 from adetailer.args import ALL_ARGS, BBOX_SORTBY, ADetailerArgs
 from adetailer.common import PredictOutput
@@ -32,11 +35,17 @@ from adetailer.mask import (
     filter_by_ratio,
     filter_k_largest,
     mask_preprocess,
+    merge_disjoint_masks,
     sort_bboxes,
 )
 from adetailer.traceback import rich_traceback
 from adetailer.ui import WebuiInfo, adui, ordinal, suffix
-from controlnet_ext import ControlNetExt, controlnet_exists, get_cn_models
+from controlnet_ext import (
+    ControlNetExt,
+    clear_cn_models_cache,
+    controlnet_exists,
+    get_cn_models,
+)
 from controlnet_ext.restore import (
     CNHijackRestore,
     cn_allow_script_control,
@@ -66,6 +75,7 @@ extra_models_dir = shared.opts.data.get("ad_extra_models_dir", "")
 model_mapping = get_models(
     adetailer_dir, extra_dir=extra_models_dir, huggingface=not no_huggingface
 )
+MODEL_KEYS = list(model_mapping.keys())
 txt2img_submit_button = img2img_submit_button = None
 SCRIPT_DEFAULT = "dynamic_prompting,dynamic_thresholding,wildcard_recursive,wildcards,lora_block_weight"
 
@@ -81,14 +91,20 @@ print(
 )
 
 
-@contextmanager
-def change_torch_load():
-    orig = torch.load
-    try:
-        torch.load = safe.unsafe_torch_load
-        yield
-    finally:
-        torch.load = orig
+def get_cyclic(lst: list[Any], i: int, default: Any) -> Any:
+    return lst[i % len(lst)] if lst else default
+
+
+@lru_cache(maxsize=8)
+def get_script_names(ad_script_names: str, controlnet: bool) -> frozenset[str]:
+    names = {
+        name
+        for script_name in ad_script_names.split(",")
+        for name in (script_name, script_name.strip())
+    }
+    if controlnet:
+        names.add("controlnet")
+    return frozenset(names)
 
 
 @contextmanager
@@ -132,6 +148,8 @@ class AfterDetailerScript(scripts.Script):
     def __init__(self):
         super().__init__()
         self.ultralytics_device = self.get_ultralytics_device()
+        self._engine_paths: dict[tuple[str, int], str] = {}
+        self._yolo_cache: dict[str, Any] = {}
 
         self.controlnet_ext = None
 
@@ -146,7 +164,6 @@ class AfterDetailerScript(scripts.Script):
 
     def ui(self, is_img2img):
         num_models = opts.data.get("ad_max_models", 2)
-        ad_model_list = list(model_mapping.keys())
         sampler_names = [sampler.name for sampler in all_samplers]
 
         try:
@@ -156,7 +173,7 @@ class AfterDetailerScript(scripts.Script):
         vae_list = modules.shared_items.sd_vae_items()
 
         webui_info = WebuiInfo(
-            ad_model_list=ad_model_list,
+            ad_model_list=MODEL_KEYS,
             sampler_names=sampler_names,
             t2i_button=txt2img_submit_button,
             i2i_button=img2img_submit_button,
@@ -217,6 +234,12 @@ class AfterDetailerScript(scripts.Script):
         not_none = any(arg.get("ad_model", "None") != "None" for arg in arg_list)
         return ad_enabled and not_none
 
+    def is_ad_enabled_p(self, p, *args_) -> bool:
+        "`process` has already checked the arguments if it stored them on `p`."
+        if getattr(p, "_ad_disabled", False):
+            return False
+        return hasattr(p, "_ad_arg_list") or self.is_ad_enabled(*args_)
+
     def check_skip_img2img(self, p, *args_) -> None:
         if (
             hasattr(p, "_ad_skip_img2img")
@@ -258,6 +281,11 @@ class AfterDetailerScript(scripts.Script):
         all_inputs = []
 
         for n, arg_dict in enumerate(args, 1):
+            if arg_dict.get("ad_model", "None") == "None":
+                # unused tab: skip validation, but keep its position for suffix(n)
+                all_inputs.append(ADetailerArgs.construct())
+                continue
+
             try:
                 inp = ADetailerArgs(**arg_dict)
             except ValueError as e:
@@ -275,10 +303,19 @@ class AfterDetailerScript(scripts.Script):
 
         return all_inputs
 
+    def get_arg_list(self, p, *args_) -> list[ADetailerArgs]:
+        "`process` validates the arguments once and stores them on `p`."
+        if not hasattr(p, "_ad_arg_list"):
+            p._ad_arg_list = self.get_args(p, *args_)
+        return p._ad_arg_list
+
     def extra_params(self, arg_list: list[ADetailerArgs]) -> dict:
-        params = {}
-        for n, args in enumerate(arg_list):
-            params.update(args.extra_params(suffix=suffix(n)))
+        params = {
+            key: value
+            for n, args in enumerate(arg_list)
+            if args.ad_model != "None"
+            for key, value in args.extra_params(suffix=suffix(n)).items()
+        }
         params["ADetailer version"] = __version__
         return params
 
@@ -299,12 +336,7 @@ class AfterDetailerScript(scripts.Script):
     def prompt_blank_replacement(
         self, all_prompts: list[str], i: int, default: str
     ) -> str:
-        if not all_prompts:
-            return default
-        if i < len(all_prompts):
-            return all_prompts[i]
-        j = i % len(all_prompts)
-        return all_prompts[j]
+        return get_cyclic(all_prompts, i, default)
 
     def _get_prompt(
         self,
@@ -343,23 +375,8 @@ class AfterDetailerScript(scripts.Script):
 
     def get_seed(self, p) -> tuple[int, int]:
         i = self.get_i(p)
-
-        if not p.all_seeds:
-            seed = p.seed
-        elif i < len(p.all_seeds):
-            seed = p.all_seeds[i]
-        else:
-            j = i % len(p.all_seeds)
-            seed = p.all_seeds[j]
-
-        if not p.all_subseeds:
-            subseed = p.subseed
-        elif i < len(p.all_subseeds):
-            subseed = p.all_subseeds[i]
-        else:
-            j = i % len(p.all_subseeds)
-            subseed = p.all_subseeds[j]
-
+        seed = get_cyclic(p.all_seeds, i, p.seed)
+        subseed = get_cyclic(p.all_subseeds, i, p.subseed)
         return seed, subseed
 
     def get_width_height(self, p, args: ADetailerArgs) -> tuple[int, int]:
@@ -434,7 +451,7 @@ class AfterDetailerScript(scripts.Script):
 
     def script_filter(self, p, args: ADetailerArgs):
         script_runner = copy(p.scripts)
-        script_args = deepcopy(p.script_args)
+        script_args = list(p.script_args)
         self.disable_controlnet_units(script_args)
 
         ad_only_seleted_scripts = opts.data.get("ad_only_seleted_scripts", True)
@@ -442,35 +459,42 @@ class AfterDetailerScript(scripts.Script):
             return script_runner, script_args
 
         ad_script_names = opts.data.get("ad_script_names", SCRIPT_DEFAULT)
-        script_names_set = {
-            name
-            for script_name in ad_script_names.split(",")
-            for name in (script_name, script_name.strip())
-        }
-
-        if args.ad_controlnet_model != "None":
-            script_names_set.add("controlnet")
-
-        filtered_alwayson = []
-        for script_object in script_runner.alwayson_scripts:
-            filepath = script_object.filename
-            filename = Path(filepath).stem
-            if filename in script_names_set:
-                filtered_alwayson.append(script_object)
+        script_names_set = get_script_names(
+            ad_script_names, args.ad_controlnet_model != "None"
+        )
+        stems = self.get_script_stems(p)
 
-        script_runner.alwayson_scripts = filtered_alwayson
+        script_runner.alwayson_scripts = [
+            script_object
+            for script_object in script_runner.alwayson_scripts
+            if stems.get(script_object) in script_names_set
+        ]
         return script_runner, script_args
 
+    @staticmethod
+    def get_script_stems(p) -> dict[Any, str]:
+        if not hasattr(p, "_ad_script_stems"):
+            p._ad_script_stems = {
+                script_object: Path(script_object.filename).stem
+                for script_object in p.scripts.alwayson_scripts
+            }
+        return p._ad_script_stems
+
     def disable_controlnet_units(self, script_args: list[Any]) -> None:
-        for obj in script_args:
+        """
+        `script_args` is a shallow copy of `p.script_args`, so units are copied
+        before being modified to leave the main generation untouched.
+        """
+        for i, obj in enumerate(script_args):
             if "controlnet" in obj.__class__.__name__.lower():
+                obj = script_args[i] = copy(obj)
                 if hasattr(obj, "enabled"):
                     obj.enabled = False
                 if hasattr(obj, "input_mode"):
                     obj.input_mode = getattr(obj.input_mode, "SIMPLE", "simple")
 
             elif isinstance(obj, dict) and "module" in obj:
-                obj["enabled"] = False
+                script_args[i] = {**obj, "enabled": False}
 
     def get_i2i_p(self, p, args: ADetailerArgs, image):
         seed, subseed = self.get_seed(p)
@@ -518,8 +542,6 @@ class AfterDetailerScript(scripts.Script):
             override_settings=override_settings,
         )
 
-        i2i.cached_c = [None, None]
-        i2i.cached_uc = [None, None]
         i2i.scripts, i2i.script_args = self.script_filter(p, args)
         i2i._ad_disabled = True
         i2i._ad_inner = True
@@ -531,13 +553,19 @@ class AfterDetailerScript(scripts.Script):
 
         return i2i
 
+    @staticmethod
+    def get_cond_cache(p, n: int) -> tuple[list, list]:
+        """
+        Share the prompt conditioning cache of the webui between all img2img
+        passes of the `n`-th tab in this job. The webui keys the cache on the
+        prompts and steps, so it is only reused when those are the same.
+        """
+        if not hasattr(p, "_ad_cond_caches"):
+            p._ad_cond_caches = {}
+        return p._ad_cond_caches.setdefault(n, ([None, None], [None, None]))
+
     def save_image(self, p, image, *, condition: str, suffix: str) -> None:
-        i = self.get_i(p)
-        if p.all_prompts:
-            i %= len(p.all_prompts)
-            save_prompt = p.all_prompts[i]
-        else:
-            save_prompt = p.prompt
+        save_prompt = get_cyclic(p.all_prompts, self.get_i(p), p.prompt)
         seed, _ = self.get_seed(p)
 
         if opts.data.get(condition, False):
@@ -555,10 +583,55 @@ class AfterDetailerScript(scripts.Script):
 
     def get_ad_model(self, name: str):
         if name not in model_mapping:
-            msg = f"[-] ADetailer: Model {name!r} not found. Available models: {list(model_mapping.keys())}"
+            msg = f"[-] ADetailer: Model {name!r} not found. Available models: {MODEL_KEYS}"
             raise ValueError(msg)
         return model_mapping[name]
 
+    def _engine_for(self, path: str) -> str:
+        if not opts.data.get("ad_export_engine", False):
+            return path
+
+        batch = opts.data.get("ad_batch_size", 4)
+        key = (path, batch)
+        if key not in self._engine_paths:
+            engine = str(
+                export_path(path, adetailer_dir, self.ultralytics_device, batch=batch)
+            )
+            # re-export when the .pt was replaced after the last export
+            if (
+                not Path(engine).exists()
+                or Path(engine).stat().st_mtime < Path(path).stat().st_mtime
+            ):
+                try:
+                    ultralytics_export(self._load_yolo(path), engine, batch=batch)
+                except Exception:
+                    error = traceback.format_exc()
+                    print(
+                        f"[-] ADetailer: Failed to export {path!r}, using it as is:\n{error}",
+                        file=sys.stderr,
+                    )
+                    engine = path
+                else:
+                    self._yolo_cache.pop(path, None)
+                    self._yolo_cache.pop(engine, None)
+            self._engine_paths[key] = engine
+        return self._engine_paths[key]
+
+    def _load_yolo(self, path: str):
+        """
+        The webui's safe `torch.load` rejects YOLO checkpoints, so it is
+        swapped out only while a model is loaded for the first time.
+        """
+        from ultralytics import YOLO
+
+        if path not in self._yolo_cache:
+            orig, torch.load = torch.load, safe.unsafe_torch_load
+            try:
+                self._yolo_cache[path] = YOLO(path)
+            finally:
+                torch.load = orig
+        return self._yolo_cache[path]
+
     def sort_bboxes(self, pred: PredictOutput) -> PredictOutput:
         sortby = opts.data.get("ad_bbox_sortby", BBOX_SORTBY[0])
         sortby_idx = BBOX_SORTBY.index(sortby)
@@ -578,6 +651,22 @@ class AfterDetailerScript(scripts.Script):
             merge_invert=args.ad_mask_merge_invert,
         ), pred)
 
+    @staticmethod
+    def can_merge_masks(
+        args: ADetailerArgs, prompts: list[str], negative_prompts: list[str]
+    ) -> bool:
+        """
+        Non-overlapping masks can share one img2img pass only when every mask
+        would be inpainted the same way: whole picture, same prompts, no makeup.
+        """
+        return (
+            opts.data.get("ad_merge_disjoint_masks", False)
+            and not args.ad_inpaint_only_masked
+            and not (args.ad_makeup_enable and args.ad_makeup_template)
+            and len(prompts) == 1
+            and len(negative_prompts) == 1
+        )
+
     @staticmethod
     def ensure_rgb_image(image: Any):
         if hasattr(image, "mode") and image.mode != "RGB":
@@ -632,6 +721,20 @@ class AfterDetailerScript(scripts.Script):
         use_same_seed = shared.opts.data.get("ad_same_seed_for_each_tap", False)
         return seed if use_same_seed else seed + i
 
+    @staticmethod
+    def get_batch_pred(p, n: int, image) -> PredictOutput | None:
+        """
+        The prediction made in `postprocess_batch_list`, if the image has not
+        been changed since by another script. Otherwise None.
+        """
+        preds = getattr(p, "_ad_batch_preds", {}).get(n)
+        if not preds or p.batch_index >= len(preds):
+            return None
+        array, pred = preds[p.batch_index]
+        if not np.array_equal(array[..., ::-1], np.asarray(image)):
+            return None
+        return pred
+
     @rich_traceback
     def process(self, p, *args_):
         if getattr(p, "_ad_disabled", False):
@@ -639,7 +742,9 @@ class AfterDetailerScript(scripts.Script):
 
         if self.is_ad_enabled(*args_):
             arg_list = self.get_args(p, *args_)
+            p._ad_arg_list = arg_list
             self.check_skip_img2img(p, *args_)
+            self.get_script_stems(p)
             extra_params = self.extra_params(arg_list)
             p.extra_generation_params.update(extra_params)
         else:
@@ -704,6 +809,7 @@ class AfterDetailerScript(scripts.Script):
 
         pp.image = self.get_i2i_init_image(p, pp)
         i2i = self.get_i2i_p(p, args, pp.image)
+        i2i.cached_c, i2i.cached_uc = self.get_cond_cache(p, n)
         seed, subseed = self.get_seed(p)
         ad_prompts, ad_negatives = self.get_prompt(p, args)
 
@@ -715,27 +821,35 @@ class AfterDetailerScript(scripts.Script):
             ad_model = args.ad_model
         else:
             predictor = ultralytics_predict
-            ad_model = self.get_ad_model(args.ad_model)
+            ad_model = self._load_yolo(
+                self._engine_for(self.get_ad_model(args.ad_model))
+            )
             kwargs["device"] = self.ultralytics_device
 
-        with change_torch_load():
+        pred = None if is_mediapipe else self.get_batch_pred(p, n, pp.image)
+        if pred is None:
             pred = predictor(ad_model, pp.image, args.ad_confidence, **kwargs)
 
         masks, new_pred = self.pred_preprocessing(pred, args)
-        shared.state.assign_current_image(pred.preview)
+        if opts.data.get("live_previews_enable", True):
+            shared.state.assign_current_image(pred.preview)
 
-        if not masks:
+        if len(masks) == 0:
             print(
                 f"[-] ADetailer: nothing detected on image {i + 1} with {ordinal(n + 1)} settings."
             )
             return False
 
-        self.save_image(
-            p,
-            pred.preview,
-            condition="ad_save_previews",
-            suffix="-ad-preview" + suffix(n, "-"),
-        )
+        if opts.data.get("ad_save_previews", False):
+            self.save_image(
+                p,
+                pred.preview,
+                condition="ad_save_previews",
+                suffix="-ad-preview" + suffix(n, "-"),
+            )
+
+        if self.can_merge_masks(args, ad_prompts, ad_negatives):
+            masks = merge_disjoint_masks(masks)
 
         steps = len(masks)
         processed = None
@@ -770,12 +884,12 @@ class AfterDetailerScript(scripts.Script):
         for j in range(steps):
             # bb = new_pred.bboxes[j]     # [x1, y1, x2, y2]
             # print(bb)
-            p2.image_mask = masks[j]
+            p2.image_mask = Image.fromarray(masks[j])
 
             # [MOD Albeforia] Find bounding boxes from processes masks
             if makeup_enabled:
                 start_timer = timeit.default_timer()
-                contours, _ = cv2.findContours(np.array(masks[j]), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)
+                contours, _ = cv2.findContours(masks[j], cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)
                 bound_rects.append(cv2.boundingRect(contours[0]))  # x, y, w, h = boundRect
                 bound_rects_squared.append(expand_rect_to_square(bound_rects[j]))
                 end_timer = timeit.default_timer()
@@ -845,13 +959,54 @@ class AfterDetailerScript(scripts.Script):
 
         return False
 
+    @rich_traceback
+    def postprocess_batch_list(self, p, pp, *args_, **kwargs):
+        """
+        Detect on the whole batch at once with the first ADetailer model.
+        Later models run on images already inpainted by the earlier ones,
+        so they still detect per image in `postprocess_image`.
+        """
+        p._ad_batch_preds = {}
+        if (
+            getattr(p, "_ad_skip_img2img", False)
+            or getattr(p, "restore_faces", False)
+            or len(pp.images) < 2
+            or not self.is_ad_enabled_p(p, *args_)
+        ):
+            return
+
+        arg_list = self.get_arg_list(p, *args_)
+        n, args = next(
+            ((n, args) for n, args in enumerate(arg_list) if args.ad_model != "None"),
+            (0, None),
+        )
+        if args is None or args.ad_model.lower().startswith("mediapipe"):
+            return
+
+        # convert on the device and copy the whole batch to the host at once:
+        # float RGB NCHW -> uint8 BGR NHWC, which ultralytics takes as is.
+        batch = torch.stack(pp.images).mul(255.0).clamp_(0, 255).to(torch.uint8)
+        images = list(batch.flip(1).permute(0, 2, 3, 1).contiguous().cpu().numpy())
+        ad_model = self._load_yolo(self._engine_for(self.get_ad_model(args.ad_model)))
+        preds = ultralytics_predict_batch(
+            ad_model,
+            images,
+            args.ad_confidence,
+            device=self.ultralytics_device,
+            batch_size=opts.data.get("ad_batch_size", 4),
+        )
+        # keep the detected images to tell in `get_batch_pred` whether
+        # another script has changed them before `postprocess_image`
+        p._ad_batch_preds[n] = list(zip(images, preds))
+
     @rich_traceback
     def postprocess_image(self, p, pp, *args_):
-        if getattr(p, "_ad_disabled", False) or not self.is_ad_enabled(*args_):
+        if not self.is_ad_enabled_p(p, *args_):
             return
 
-        init_image = copy(pp.image)
-        arg_list = self.get_args(p, *args_)
+        save_before = opts.data.get("ad_save_images_before", False)
+        init_image = copy(pp.image) if save_before else None
+        arg_list = self.get_arg_list(p, *args_)
 
         if self.need_call_postprocess(p):
             dummy = Processed(p, [], p.seed, "")
@@ -868,7 +1023,11 @@ class AfterDetailerScript(scripts.Script):
                 end_timer = timeit.default_timer()
                 print(f"[-] ADetailer: _postprocess_image_inner() - {(end_timer - start_timer) * 1000:.2f} ms")
 
-        if is_processed and not getattr(p, "_ad_skip_img2img", False):
+        if (
+            save_before
+            and is_processed
+            and not getattr(p, "_ad_skip_img2img", False)
+        ):
             self.save_image(
                 p, init_image, condition="ad_save_images_before", suffix="-ad-before"
             )
@@ -967,6 +1126,35 @@ def on_ui_settings():
         ),
     )
 
+    shared.opts.add_option(
+        "ad_batch_size",
+        shared.OptionInfo(
+            default=4,
+            label="Detection batch size",
+            component=gr.Slider,
+            component_args={"minimum": 1, "maximum": 16, "step": 1},
+            section=section,
+        ),
+    )
+
+    shared.opts.add_option(
+        "ad_export_engine",
+        shared.OptionInfo(
+            False,
+            "Export ultralytics models to TensorRT (CUDA) or ONNX (CPU) on first use",
+            section=section,
+        ),
+    )
+
+    shared.opts.add_option(
+        "ad_merge_disjoint_masks",
+        shared.OptionInfo(
+            False,
+            "Inpaint non-overlapping masks in a single pass (only when 'Inpaint only masked' is off)",
+            section=section,
+        ),
+    )
+
 
 # xyz_grid
 
@@ -1002,7 +1190,7 @@ def make_axis_on_xyz_grid():
     if xyz_grid is None:
         return
 
-    model_list = ["None", *model_mapping.keys()]
+    model_list = ["None", *MODEL_KEYS]
     samplers = [sampler.name for sampler in all_samplers]
 
     axis = [
@@ -1072,6 +1260,9 @@ def make_axis_on_xyz_grid():
 
 
 def on_before_ui():
+    # rescan controlnet models when the ui is (re)built
+    clear_cn_models_cache()
+
     try:
         make_axis_on_xyz_grid()
     except Exception: